@@ -0,0 +1,145 @@
+import os
+import json
+import logging
+
+SNAPSHOT_VERSION = 1
+
+class ConfigError(ValueError):
+    pass
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def coordinate(value, limit, where, errors):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        errors.append(f"{where} is not a number: {value!r}")
+        return None
+    if not -limit <= value <= limit:
+        errors.append(f"{where} is out of range: {value}")
+        return None
+    return value
+
+def compile_locations(locations, errors):
+    compiled = {}
+    for name, location in locations.items():
+        if not isinstance(location, dict):
+            errors.append(f"geographic_locations/{name} is not an object")
+            continue
+        where = f"geographic_locations/{name}"
+        compiled[name] = {
+            "latitude": coordinate(location.get("latitude"), 90, where + "/latitude", errors),
+            "longitude": coordinate(location.get("longitude"), 180, where + "/longitude", errors),
+        }
+    return compiled
+
+def compile_stations(stations, source, errors):
+    # Stations are either a bare ID or an object with ID and optional coordinates
+    compiled = {}
+    for name, station in stations.items():
+        where = f"stations/{source}/{name}"
+        if isinstance(station, (str, int)):
+            compiled[name] = {"id": str(station)}
+        elif isinstance(station, dict) and "id" in station:
+            compiled[name] = {"id": str(station["id"])}
+            if "latitude" in station or "longitude" in station:
+                compiled[name]["latitude"] = coordinate(
+                    station.get("latitude"), 90, where + "/latitude", errors
+                )
+                compiled[name]["longitude"] = coordinate(
+                    station.get("longitude"), 180, where + "/longitude", errors
+                )
+        else:
+            errors.append(f"{where} is neither an ID nor an object with an id")
+    return compiled
+
+def located(stations):
+    return [
+        name for name, station in stations.items()
+        if station.get("latitude") is not None and station.get("longitude") is not None
+    ]
+
+def section(data, key, where, errors):
+    # A missing section is reported by the lookups into it, a malformed one here
+    value = data.get(key)
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        errors.append(f"{where} is not an object")
+        return {}
+    return value
+
+def compile_config(datafile, source, city, location, build_url, need_location=True,
+                   need_coordinates=False):
+    """Validate datafile for one source/city/location and return its snapshot.
+
+    need_coordinates requires at least one station with coordinates, for
+    picking the nearest ones. Raises ConfigError listing every problem found.
+    """
+    try:
+        with open(datafile) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Failed to read {datafile}: {e}")
+    errors = []
+    if not isinstance(data, dict):
+        raise ConfigError(f"{datafile} does not hold a JSON object")
+    locations = compile_locations(
+        section(data, "geographic_locations", "geographic_locations", errors), errors
+    )
+    sources = section(data, "stations", "stations", errors)
+    stations = compile_stations(
+        section(sources, source, f"stations/{source}", errors), source, errors
+    )
+    if city not in locations:
+        errors.append(f"City {city!r} is missing under geographic_locations")
+    if need_location and location not in stations:
+        errors.append(f"Location {location!r} is missing under stations/{source}")
+    if need_coordinates and not located(stations):
+        errors.append(f"No station under stations/{source} has latitude and longitude")
+    if errors:
+        raise ConfigError("; ".join(errors))
+
+    lat, lon = locations[city]["latitude"], locations[city]["longitude"]
+    station = stations.get(location)
+    return {
+        "version": SNAPSHOT_VERSION,
+        "selection": [os.path.realpath(datafile), source, city, location],
+        "latitude": lat,
+        "longitude": lon,
+        "station_id": station["id"] if station else None,
+        "url": build_url(source, lat, lon, station["id"]) if station else None,
+        "stations": stations,
+    }
+
+def load_config(snapshot_path, datafile, source, city, location, build_url, dotenv=None,
+                need_location=True, need_coordinates=False):
+    """Return the compiled snapshot, recompiling it when datafile or dotenv changed."""
+    inputs = [file_mtime(datafile), file_mtime(dotenv) if dotenv else None]
+    selection = [os.path.realpath(datafile), source, city, location]
+    try:
+        with open(snapshot_path) as f:
+            snapshot = json.load(f)
+        if (snapshot["version"] == SNAPSHOT_VERSION and snapshot["inputs"] == inputs
+                and snapshot["selection"] == selection
+                and (snapshot["station_id"] is not None or not need_location)
+                and (located(snapshot["stations"]) or not need_coordinates)):
+            return snapshot
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    logging.info("Compiling configuration snapshot from %s", datafile)
+    snapshot = compile_config(
+        datafile, source, city, location, build_url, need_location, need_coordinates
+    )
+    snapshot["inputs"] = inputs
+    try:
+        with open(snapshot_path + ".tmp", "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(snapshot_path + ".tmp", snapshot_path)
+    except OSError as e:
+        logging.warning("Failed to save configuration snapshot: %s", e)
+    return snapshot
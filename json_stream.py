@@ -0,0 +1,131 @@
+import re
+import json
+import codecs
+
+# Strings (possibly cut off at the end of the buffer) and container brackets
+TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?P<end>")?|[{}\[\]]')
+# Characters a number can hold, to tell when one is cut off at the end of the buffer
+NUMBER_CHARS = re.compile(r"[-+0-9.eE]*")
+WHITESPACE = " \t\n\r"
+
+class JsonStreamReader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self.text_decoder.decode(b"", final=True)
+        elif isinstance(chunk, str):
+            text = chunk
+        else:
+            text = self.text_decoder.decode(chunk)
+        # Drop the consumed part, so only unread data stays in memory
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at JSON stream offset {self.pos}")
+        self.pos += 1
+
+    def decode_value(self):
+        # A number at the end of the buffer may continue in the next chunk,
+        # possibly past a point where its prefix would already decode
+        while (self.peek() in "-0123456789"
+               and NUMBER_CHARS.match(self.buf, self.pos).end() == len(self.buf)
+               and self.fill()):
+            pass
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        if self.peek() not in "{[":
+            self.decode_value()
+            return
+        depth = 0
+        while True:
+            match = TOKEN.search(self.buf, self.pos)
+            if match is None or (match.group(0)[0] == '"' and match.group("end") is None):
+                self.pos = len(self.buf) if match is None else match.start()
+                if not self.fill():
+                    raise ValueError("Unexpected end of JSON stream")
+                continue
+            self.pos = match.end()
+            char = match.group(0)[0]
+            if char in "{[":
+                depth += 1
+            elif char in "}]":
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def decode_array(self, reducer):
+        values = []
+        self.expect("[")
+        while self.peek() != "]":
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            values.append(reducer(self.decode_value()))
+        self.pos += 1
+        return values
+
+    def decode_object(self, spec, stop_early=False):
+        values = {}
+        self.expect("{")
+        while self.peek() != "}":
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            key = self.decode_value()
+            self.expect(":")
+            selected = spec.get(key, False)
+            if selected is False:
+                self.skip_value()
+            elif selected is None or self.peek() == "n":
+                # null stands in for a selected object or array
+                values[key] = self.decode_value()
+            elif isinstance(selected, dict):
+                values[key] = self.decode_object(selected)
+            else:
+                values[key] = self.decode_array(selected)
+            if stop_early and len(values) == len(spec):
+                return values
+        self.pos += 1
+        return values
+
+def extract_json(chunks, spec):
+    """Decode only the members selected by spec from a stream of JSON chunks.
+
+    spec maps object keys to None (decode the whole value), a nested spec
+    dict (descend into the object) or a callable (reduce each element of
+    the array). Other members are skipped without being decoded, and
+    reading stops once every top level key in spec has been found.
+    """
+    return JsonStreamReader(chunks).decode_object(spec, stop_early=True)
@@ -28,12 +28,15 @@
 #
 
 
+import time
 import logging
 from . import epdconfig
 
 # Display resolution
 EPD_WIDTH       = 122
 EPD_HEIGHT      = 250
+# Number of preallocated frame buffers handed out by getbuffer in turn
+FRAME_BUFFER_COUNT = 2
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +48,29 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        # time.monotonic() value after which ReadBusy gives up, None waits forever
+        self.busy_deadline = None
+
+        # Packed frames are written into preallocated buffers, and clears send
+        # constant fill buffers, so no per-frame allocation reaches the SPI layer
+        if self.width%8 == 0:
+            self.linewidth = int(self.width/8)
+        else:
+            self.linewidth = int(self.width/8) + 1
+        self.buffer_size = self.linewidth * self.height
+        self.frame_buffers = [bytearray(self.buffer_size) for _ in range(FRAME_BUFFER_COUNT)]
+        self.frame_index = 0
+        self.fill_buffers = {}
+
+    '''
+    function : Constant buffer filled with one byte value
+    parameter:
+        color : Fill byte
+    '''
+    def fill_buffer(self, color):
+        if color not in self.fill_buffers:
+            self.fill_buffers[color] = bytes([color]) * self.buffer_size
+        return self.fill_buffers[color]
 
     '''
     function :Hardware reset
@@ -94,6 +120,8 @@ class EPD:
     def ReadBusy(self):
         logger.debug("e-Paper busy")
         while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
+            if self.busy_deadline is not None and time.monotonic() > self.busy_deadline:
+                raise TimeoutError("e-Paper busy past deadline")
             epdconfig.delay_ms(10)
         logger.debug("e-Paper busy release")
 
@@ -248,17 +276,21 @@ class EPD:
         img = image
         imwidth, imheight = img.size
         if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
+            pass
         elif(imwidth == self.height and imheight == self.width):
             # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
+            img = img.rotate(90, expand=True)
         else:
             logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
             # return a blank buffer
-            return [0x00] * (int(self.width/8) * self.height)
+            return self.fill_buffer(0x00)
+        if img.mode != '1':
+            img = img.convert('1')
 
-        buf = bytearray(img.tobytes('raw'))
-        return buf
+        buf = self.frame_buffers[self.frame_index]
+        self.frame_index = (self.frame_index + 1) % FRAME_BUFFER_COUNT
+        buf[:] = img.tobytes('raw')
+        return memoryview(buf)
 
     '''
     function : Sends the image buffer in RAM to e-Paper and displays
@@ -325,14 +357,8 @@ class EPD:
     parameter:
     '''
     def Clear(self, color=0xFF):
-        if self.width%8 == 0:
-            linewidth = int(self.width/8)
-        else:
-            linewidth = int(self.width/8) + 1
-        # logger.debug(linewidth)
-
         self.send_command(0x24)
-        self.send_data2([color] * int(self.height * linewidth))
+        self.send_data2(self.fill_buffer(color))
         self.TurnOnDisplay()
 
     '''
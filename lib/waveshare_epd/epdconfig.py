@@ -264,6 +264,184 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
+class Emulator:
+    # Pin definition
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    # Panel geometry of the emulated controller RAM
+    _RAM_WIDTH  = 128
+    _RAM_HEIGHT = 250
+    _PANEL_WIDTH = 122
+
+    def __init__(self, full_ms=2000, fast_ms=1500, partial_ms=300, reset_ms=10,
+                 spi_hz=4000000, time_scale=0.0, output=None):
+        # Busy durations per update sequence, keyed by the 0x22 control byte
+        self._update_ms = {0xF7: full_ms, 0xC7: fast_ms, 0xFF: partial_ms}
+        self._reset_ms = reset_ms
+        self._spi_hz = spi_hz
+        # 0 runs on the virtual clock only, 1 also sleeps in real time
+        self._time_scale = time_scale
+        self._output = output
+
+        self._clock_ms = 0.0
+        self._busy_until = 0.0
+        self._pins = {self.RST_PIN: 0, self.DC_PIN: 0, self.CS_PIN: 1, self.PWR_PIN: 0}
+        self._ram = {
+            0x24: bytearray(b'\xff' * (self._RAM_WIDTH // 8 * self._RAM_HEIGHT)),
+            0x26: bytearray(b'\xff' * (self._RAM_WIDTH // 8 * self._RAM_HEIGHT)),
+        }
+        self._stats = {
+            "bytes": 0,
+            "commands": 0,
+            "command_counts": {},
+            "busy_ms": 0.0,
+            "refreshes": {},
+        }
+        self._reset_controller()
+
+    def _reset_controller(self):
+        self._command = None
+        self._args = []
+        self._update_control = 0xF7
+        self._sleeping = False
+        self._window = (0, self._RAM_WIDTH // 8 - 1, 0, self._RAM_HEIGHT - 1)
+        self._cursor = [0, 0]
+
+    def _advance(self, ms):
+        self._clock_ms += ms
+        if self._time_scale:
+            time.sleep(ms * self._time_scale / 1000.0)
+
+    def _set_busy(self, ms):
+        self._busy_until = max(self._busy_until, self._clock_ms) + ms
+        self._stats["busy_ms"] += ms
+
+    def digital_write(self, pin, value):
+        if pin == self.RST_PIN and self._pins[pin] and not value:
+            self._reset_controller()
+            self._set_busy(self._reset_ms)
+        self._pins[pin] = value
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 1 if self._clock_ms < self._busy_until else 0
+        return self._pins.get(pin, 0)
+
+    def delay_ms(self, delaytime):
+        self._advance(delaytime)
+
+    def spi_writebyte(self, data):
+        self._transfer(data)
+
+    def spi_writebyte2(self, data):
+        self._transfer(data)
+
+    def _transfer(self, data):
+        self._advance(len(data) * 8 * 1000.0 / self._spi_hz)
+        self._stats["bytes"] += len(data)
+        if self._pins[self.DC_PIN]:
+            if self._command in self._ram:
+                self._write_ram(self._command, data)
+            else:
+                self._args.extend(data)
+                self._apply_args()
+        else:
+            for command in data:
+                self._start_command(command)
+
+    def _start_command(self, command):
+        self._command = command
+        self._args = []
+        self._stats["commands"] += 1
+        counts = self._stats["command_counts"]
+        counts[command] = counts.get(command, 0) + 1
+        if command == 0x12: # SWRESET
+            self._reset_controller()
+            self._set_busy(self._reset_ms)
+        elif command == 0x20: # Activate Display Update Sequence
+            self._activate()
+        elif command == 0x10: # Deep sleep mode
+            self._sleeping = True
+
+    def _apply_args(self):
+        args = self._args
+        if self._command == 0x22 and len(args) == 1:
+            self._update_control = args[0]
+        elif self._command == 0x44 and len(args) == 2:
+            self._window = (args[0], args[1]) + self._window[2:]
+        elif self._command == 0x45 and len(args) == 4:
+            self._window = self._window[:2] + (args[0] | args[1] << 8, args[2] | args[3] << 8)
+        elif self._command == 0x4E and len(args) == 1:
+            self._cursor[0] = args[0]
+        elif self._command == 0x4F and len(args) == 2:
+            self._cursor[1] = args[0] | args[1] << 8
+
+    def _write_ram(self, bank, data):
+        if self._sleeping:
+            logger.warning("Emulated e-Paper ignores RAM write in deep sleep")
+            return
+        ram = self._ram[bank]
+        x_start, x_end, y_start, y_end = self._window
+        line = self._RAM_WIDTH // 8
+        x, y = self._cursor
+        # Data entry mode 0x03: X increments first, then Y
+        for value in data:
+            if x < line and y < self._RAM_HEIGHT:
+                ram[y * line + x] = value
+            x += 1
+            if x > x_end:
+                x = x_start
+                y += 1
+                if y > y_end:
+                    y = y_start
+        self._cursor = [x, y]
+
+    def _activate(self):
+        mode = self._update_control
+        duration = self._update_ms.get(mode)
+        if duration is None:
+            # Temperature loads and other non-refresh sequences
+            duration = self._reset_ms
+        else:
+            refreshes = self._stats["refreshes"]
+            refreshes[mode] = refreshes.get(mode, 0) + 1
+        self._set_busy(duration)
+
+    def image(self, bank=0x24):
+        from PIL import Image
+        image = Image.frombytes("1", (self._RAM_WIDTH, self._RAM_HEIGHT), bytes(self._ram[bank]))
+        return image.crop((0, 0, self._PANEL_WIDTH, self._RAM_HEIGHT))
+
+    def statistics(self):
+        return self._stats
+
+    def report(self):
+        logger.info(
+            "Emulated e-Paper: %d bytes, %d commands, %.0fms busy, %.0fms elapsed, refreshes %s",
+            self._stats["bytes"], self._stats["commands"], self._stats["busy_ms"],
+            self._clock_ms, {hex(k): v for k, v in self._stats["refreshes"].items()}
+        )
+        return self._stats
+
+    def module_init(self):
+        self._pins[self.PWR_PIN] = 1
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("spi end")
+        self._pins[self.RST_PIN] = 0
+        self._pins[self.DC_PIN] = 0
+        self._pins[self.PWR_PIN] = 0
+        self.report()
+        if self._output:
+            self.image().save(self._output)
+            logger.info("Emulated e-Paper image saved to %s", self._output)
+
+
 if sys.version_info[0] == 2:
     process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
 else:
@@ -272,7 +450,15 @@ output, _ = process.communicate()
 if sys.version_info[0] == 2:
     output = output.decode(sys.stdout.encoding)
 
-if "Raspberry" in output:
+if os.environ.get("EPD_EMULATOR"):
+    implementation = Emulator(
+        full_ms=float(os.environ.get("EPD_EMULATOR_FULL_MS", 2000)),
+        fast_ms=float(os.environ.get("EPD_EMULATOR_FAST_MS", 1500)),
+        partial_ms=float(os.environ.get("EPD_EMULATOR_PARTIAL_MS", 300)),
+        time_scale=float(os.environ.get("EPD_EMULATOR_TIME_SCALE", 0)),
+        output=os.environ.get("EPD_EMULATOR_OUTPUT"),
+    )
+elif "Raspberry" in output:
     implementation = RaspberryPi()
 elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
     implementation = SunriseX3()
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+
+# Requests allowed in a burst on top of the evenly spread daily rate
+QUOTA_BURST = 5
+# Callers asking for the same request within this many seconds share one upstream call
+COALESCE_TTL = 60
+# How long to back off after the API reports the limit as exceeded, without Retry-After
+DEFAULT_BACKOFF = 3600
+LOCK_POLL_INTERVAL = 0.05
+
+def digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+def lock_file(path, deadline=None):
+    """Open path and take an exclusive flock on it, giving up at deadline (time.monotonic())."""
+    lock = open(path, "a")
+    while True:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock
+        except OSError:
+            if deadline is not None and time.monotonic() >= deadline:
+                lock.close()
+                return None
+            time.sleep(LOCK_POLL_INTERVAL)
+
+class QuotaManager:
+    """Token bucket per API key and request coalescing, shared through files in state_dir.
+
+    Every process on the device using the same state_dir sees the same buckets,
+    so the daily limit is spread evenly over the day for all of them together.
+    """
+    def __init__(self, state_dir, daily_limit, burst=QUOTA_BURST, ttl=COALESCE_TTL,
+                 max_reuse_age=None):
+        self.state_dir = state_dir
+        self.rate = daily_limit / 86400.0
+        self.burst = burst
+        self.ttl = ttl
+        self.max_reuse_age = max_reuse_age
+        # Set when a request was refused for lack of quota and nothing stored could stand in
+        self.refused = False
+        # Ages of stored responses handed out in place of refused requests
+        self.reused_ages = []
+        os.makedirs(state_dir, exist_ok=True)
+
+    def update_bucket(self, key, update):
+        path = os.path.join(self.state_dir, f"quota_{digest(key)}.json")
+        lock = lock_file(path + ".lock")
+        try:
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {"tokens": self.burst, "updated": time.time(), "blocked_until": 0}
+            now = time.time()
+            state["tokens"] = min(self.burst, state["tokens"] + (now - state["updated"]) * self.rate)
+            state["updated"] = now
+            result = update(state, now)
+            with open(path + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(path + ".tmp", path)
+            return result
+        finally:
+            lock.close()
+
+    def acquire(self, key):
+        def take(state, now):
+            if now < state["blocked_until"] or state["tokens"] < 1:
+                return False
+            state["tokens"] -= 1
+            return True
+        return self.update_bucket(key, take)
+
+    def block(self, key, seconds=DEFAULT_BACKOFF):
+        def drain(state, now):
+            state["tokens"] = 0
+            state["blocked_until"] = max(state["blocked_until"], now + seconds)
+        self.update_bucket(key, drain)
+        logging.warning("API limit exceeded, no requests for %ds", seconds)
+
+    def fetch(self, key, request, load, timeout=None):
+        """Return load() for request, sharing one upstream call between concurrent callers.
+
+        The first caller holds the request lock while calling upstream, the others
+        wait for it and get its stored response. When the key is out of quota the
+        last stored response is returned if it is no older than max_reuse_age,
+        with its age added to reused_ages, or None (setting refused) when there
+        is none. Returns None as well when the lock is not released within timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        path = os.path.join(self.state_dir, f"response_{digest(request)}.json")
+        lock = lock_file(path + ".lock", deadline)
+        if lock is None:
+            logging.warning("Timed out waiting for a coalesced request")
+            return None
+        try:
+            try:
+                if time.time() - os.path.getmtime(path) < self.ttl:
+                    with open(path) as f:
+                        logging.info("Reusing response of a coalesced request")
+                        return json.load(f)
+            except (OSError, ValueError):
+                pass
+            if key is not None and not self.acquire(key):
+                try:
+                    age = time.time() - os.path.getmtime(path)
+                    if self.max_reuse_age is None or age <= self.max_reuse_age:
+                        with open(path) as f:
+                            data = json.load(f)
+                        logging.warning("API quota exhausted, reusing response from %ds ago", age)
+                        self.reused_ages.append(age)
+                        return data
+                except (OSError, ValueError):
+                    pass
+                logging.warning("API quota exhausted, skipping request")
+                self.refused = True
+                return None
+            data = load()
+            if data is not None:
+                with open(path + ".tmp", "w") as f:
+                    json.dump(data, f)
+                os.replace(path + ".tmp", path)
+            return data
+        finally:
+            lock.close()
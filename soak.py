@@ -0,0 +1,170 @@
+import os
+import gc
+import sys
+import time
+import random
+import logging
+import datetime
+import argparse
+import itertools
+
+# Replay always drives the emulated panel
+os.environ["EPD_EMULATOR"] = "1"
+os.environ.pop("EPD_EMULATOR_OUTPUT", None)
+os.environ.pop("EPD_EMULATOR_TIME_SCALE", None)
+
+import weather_display as wd
+from PIL import Image
+from tracefile import DriverTap, read_trace, trace_cycles
+from waveshare_epd import epd2in13_V4, epdconfig
+
+def input_arguments():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded or synthetic cycles through parse, render and an emulated panel.",
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        "--trace", default=None, type=str,
+        help=("Trace file written by weather_display.py --record, repeated as needed.\n"
+              "Synthetic Airly responses are generated when not provided.")
+    )
+    parser.add_argument(
+        "--cycles", default=10000, type=int,
+        help=("Number of cycles to run.")
+    )
+    parser.add_argument(
+        "--interval", default=60, type=float,
+        help=("Seconds between cycles in the field, used to report the speedup.")
+    )
+    parser.add_argument(
+        "--warmup", default=100, type=int,
+        help=("Cycles run before taking the baseline for growth figures.")
+    )
+    parser.add_argument(
+        "--sample-every", default=1000, type=int,
+        help=("Report progress every this many cycles.")
+    )
+    parser.add_argument(
+        "--seed", default=0, type=int,
+        help=("Random seed for synthetic responses.")
+    )
+    parser.add_argument(
+        "--rotate", action="store_true",
+        help=("Rotates image by 180 degrees when provided.")
+    )
+    return parser.parse_args()
+
+def synthetic_response(rng):
+    # Roughly one in twenty fetches fails, to exercise the cached fallback
+    if rng.random() < 0.05:
+        return None
+    values = [
+        {"name": "PM25", "value": round(rng.uniform(0, 80), 2)},
+        {"name": "PM10", "value": round(rng.uniform(0, 120), 2)},
+        {"name": "PRESSURE", "value": round(rng.uniform(980, 1040), 2)},
+        {"name": "HUMIDITY", "value": round(rng.uniform(20, 100), 2)},
+        {"name": "TEMPERATURE", "value": round(rng.uniform(-20, 35), 2)},
+    ]
+    standards = [
+        {"name": "WHO", "pollutant": "PM25", "limit": 15, "percent": 0, "averaging": "24h"},
+        {"name": "WHO", "pollutant": "PM10", "limit": 45, "percent": 0, "averaging": "24h"},
+    ]
+    hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    forecast = [
+        {
+            "fromDateTime": (hour + datetime.timedelta(hours=h)).isoformat().replace("+00:00", "Z"),
+            "pm25": round(rng.uniform(0, 40), 2),
+            "pm10": round(rng.uniform(0, 60), 2),
+        }
+        for h in range(24)
+    ]
+    return {"current": {"values": values, "standards": standards}, "forecast": forecast}
+
+def synthetic_cycles(seed):
+    rng = random.Random(seed)
+    while True:
+        response = synthetic_response(rng)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        yield now, ([(0.0, response)] if response is not None else []), []
+
+def replay_cycle(responses, last_weather, rotate, now=None):
+    weather = wd.parse_readings("airly", responses)
+    stale = weather is None
+    if stale:
+        weather = last_weather
+        if weather is None:
+            return None
+    # Forecast hours are picked relative to when the cycle ran, not to the replay
+    image = wd.render_weather(weather, stale, now=now)
+    wd.display_image(epd2in13_V4.EPD(), image, rotate)
+    return weather
+
+def rss_kb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+def live_images():
+    gc.collect()
+    return sum(1 for o in gc.get_objects() if isinstance(o, Image.Image))
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def main():
+    args = input_arguments()
+    if args.trace:
+        cycles = list(trace_cycles(read_trace(args.trace)))
+        if not cycles:
+            sys.exit(f"No cycles in trace {args.trace}")
+        source = itertools.cycle(cycles)
+    else:
+        source = synthetic_cycles(args.seed)
+    tap = DriverTap(epdconfig)
+
+    # Cycles log on every draw, keep that out of the measurements
+    logging.disable(logging.CRITICAL)
+    latencies = []
+    mismatches = 0
+    weather = None
+    baseline = None
+    start = time.perf_counter()
+    for cycle, (when, responses, recorded) in enumerate(itertools.islice(source, args.cycles + args.warmup)):
+        if cycle == args.warmup:
+            baseline = (rss_kb(), open_fds(), live_images())
+            start = time.perf_counter()
+        cycle_start = time.perf_counter()
+        weather = replay_cycle(responses, weather, args.rotate, when) or weather
+        if cycle >= args.warmup:
+            latencies.append(time.perf_counter() - cycle_start)
+        replayed = tap.take()
+        if recorded and replayed and replayed != recorded:
+            mismatches += 1
+        if cycle >= args.warmup and (cycle - args.warmup + 1) % args.sample_every == 0:
+            logging.disable(logging.NOTSET)
+            logging.info("Cycle %d, RSS %dkB", cycle - args.warmup + 1, rss_kb())
+            logging.disable(logging.CRITICAL)
+    wall = time.perf_counter() - start
+    logging.disable(logging.NOTSET)
+
+    if baseline is None:
+        sys.exit("Not enough cycles to get past warmup")
+    rss, fds, images = rss_kb(), open_fds(), live_images()
+    latencies.sort()
+    stats = epdconfig.statistics()
+    print(f"Cycles:        {len(latencies)} in {wall:.1f}s, "
+          f"{len(latencies) * args.interval / wall:.0f}x real time")
+    print(f"Latency (ms):  p50 {percentile(latencies, 50) * 1000:.2f}, "
+          f"p90 {percentile(latencies, 90) * 1000:.2f}, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f}, max {latencies[-1] * 1000:.2f}")
+    print(f"RSS (kB):      {baseline[0]} -> {rss}, growth {rss - baseline[0]}")
+    print(f"Open files:    {baseline[1]} -> {fds}")
+    print(f"PIL images:    {baseline[2]} -> {images}")
+    print(f"Panel:         {stats['bytes']} bytes, {stats['commands']} commands, "
+          f"{stats['busy_ms'] / 1000:.0f}s busy")
+    if args.trace:
+        print(f"Driver stream: {mismatches} cycles differ from the recording")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import math
+import heapq
+import logging
+
+EARTH_RADIUS_KM = 6371.0
+# Readings further than this many median absolute deviations from the median are dropped
+OUTLIER_THRESHOLD = 3.0
+# Spread never considered smaller than this fraction of the median,
+# so near identical readings do not turn every difference into an outlier
+OUTLIER_MIN_SPREAD = 0.1
+# Nor smaller than these absolute amounts, in each quantity's unit, so values
+# at or around zero (clean air, temperatures near freezing) are not rejected
+# for the smallest difference
+OUTLIER_MIN_ABS_SPREAD = {"pm25": 2.0, "pm10": 2.0, "pres": 1.0, "humi": 3.0, "temp": 1.0}
+DEFAULT_MIN_ABS_SPREAD = 1.0
+# Added to distances before inverse square weighting, so a station next to
+# the point does not get an unbounded weight
+DISTANCE_FLOOR_KM = 0.5
+
+def to_unit_vector(lat, lon):
+    lat = math.radians(float(lat))
+    lon = math.radians(float(lon))
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+def chord_to_km(chord_squared):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+class StationIndex:
+    """k-d tree over station positions on the unit sphere.
+
+    Straight line (chord) distance between unit vectors orders points the
+    same way as great circle distance, so nearest neighbours are exact.
+    """
+    def __init__(self, stations):
+        # stations: iterable of (station_id, latitude, longitude)
+        points = [(to_unit_vector(lat, lon), station_id) for station_id, lat, lon in stations]
+        self.size = len(points)
+        self.root = self.build(points, 0)
+
+    def build(self, points, axis):
+        if not points:
+            return None
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        next_axis = (axis + 1) % 3
+        return (points[mid], axis,
+                self.build(points[:mid], next_axis), self.build(points[mid + 1:], next_axis))
+
+    def nearest(self, lat, lon, k):
+        """Return up to k (distance_km, station_id) pairs, nearest first."""
+        target = to_unit_vector(lat, lon)
+        heap = []  # max-heap of (-chord_squared, station_id)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (point, station_id), axis, left, right = node
+            chord_squared = sum((a - b) ** 2 for a, b in zip(point, target))
+            if len(heap) < k:
+                heapq.heappush(heap, (-chord_squared, station_id))
+            elif chord_squared < -heap[0][0]:
+                heapq.heapreplace(heap, (-chord_squared, station_id))
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Visit the far side only if it can hold something closer than the worst kept
+            if len(heap) < k or diff ** 2 < -heap[0][0]:
+                stack.append(far)
+            stack.append(near)
+        return sorted((chord_to_km(-c), station_id) for c, station_id in heap)
+
+def aggregate_readings(readings, threshold=OUTLIER_THRESHOLD):
+    """Combine (distance_km, values) readings from several stations into one values dict.
+
+    Each value is a distance weighted mean over the stations that reported it,
+    after dropping outliers. Norms and non numeric values, like forecasts,
+    are taken from the nearest station.
+    """
+    readings = sorted(readings, key=lambda r: r[0])
+    keys = {key for _, values in readings for key in values}
+    aggregated = {}
+    for key in keys:
+        candidates = [(d, v[key]) for d, v in readings if v.get(key) is not None]
+        if not candidates:
+            aggregated[key] = None
+            continue
+        numeric = isinstance(candidates[0][1], (int, float))
+        if len(candidates) == 1 or key.endswith("_norm") or not numeric:
+            aggregated[key] = candidates[0][1]
+            continue
+        values = sorted(v for _, v in candidates)
+        median = values[len(values) // 2]
+        deviations = sorted(abs(v - median) for v in values)
+        spread = max(
+            deviations[len(deviations) // 2],
+            OUTLIER_MIN_SPREAD * abs(median),
+            OUTLIER_MIN_ABS_SPREAD.get(key, DEFAULT_MIN_ABS_SPREAD),
+        )
+        kept = [(d, v) for d, v in candidates if abs(v - median) <= threshold * spread]
+        if len(kept) < len(candidates):
+            logging.warning(
+                "Rejected %d outlying %s readings", len(candidates) - len(kept), key
+            )
+        weights = [1 / (d + DISTANCE_FLOOR_KM) ** 2 for d, _ in kept]
+        aggregated[key] = round(sum(w * v for w, (_, v) in zip(weights, kept)) / sum(weights), 2)
+    return aggregated
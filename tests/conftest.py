@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Tests run on the emulated panel, without a HAT
+os.environ["EPD_EMULATOR"] = "1"
+os.environ.pop("EPD_EMULATOR_OUTPUT", None)
+os.environ.pop("EPD_EMULATOR_TIME_SCALE", None)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "lib"))
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from config import ConfigError, compile_config, load_config
+
+def build_url(source, lat, lon, station_id):
+    return f"{source}/{station_id}"
+
+def write(tmp_path, data):
+    path = tmp_path / "data.json"
+    path.write_text(json.dumps(data))
+    return str(path)
+
+DATA = {
+    "geographic_locations": {"lodz": {"latitude": "51.76", "longitude": "19.46"}},
+    "stations": {"airly": {
+        "bartoka": "8173",
+        "centrum": {"id": "1234", "latitude": "51.75", "longitude": "19.45"},
+    }},
+}
+
+def test_compiles_selected_station(tmp_path):
+    config = compile_config(write(tmp_path, DATA), "airly", "lodz", "bartoka", build_url)
+    assert config["latitude"] == 51.76
+    assert config["url"] == "airly/8173"
+    assert config["stations"]["centrum"] == {"id": "1234", "latitude": 51.75, "longitude": 19.45}
+
+@pytest.mark.parametrize("data, message", [
+    ({"geographic_locations": ["lodz"], "stations": DATA["stations"]},
+     "geographic_locations is not an object"),
+    ({"geographic_locations": DATA["geographic_locations"], "stations": ["airly"]},
+     "stations is not an object"),
+    ({"geographic_locations": DATA["geographic_locations"], "stations": {"airly": "8173"}},
+     "stations/airly is not an object"),
+])
+def test_malformed_sections_raise_config_error(tmp_path, data, message):
+    with pytest.raises(ConfigError, match=message):
+        compile_config(write(tmp_path, data), "airly", "lodz", "bartoka", build_url)
+
+def test_nearest_needs_a_station_with_coordinates(tmp_path):
+    data = dict(DATA, stations={"airly": {"bartoka": "8173"}})
+    path = write(tmp_path, data)
+    with pytest.raises(ConfigError, match="latitude and longitude"):
+        compile_config(path, "airly", "lodz", None, build_url, need_location=False,
+                       need_coordinates=True)
+    # A snapshot cached for a single location does not get past the check either
+    snapshot = str(tmp_path / "snapshot.json")
+    load_config(snapshot, path, "airly", "lodz", None, build_url, need_location=False)
+    with pytest.raises(ConfigError):
+        load_config(snapshot, path, "airly", "lodz", None, build_url, need_location=False,
+                    need_coordinates=True)
@@ -0,0 +1,130 @@
+import argparse
+import json
+import time
+
+import pytest
+
+import weather_display as wd
+
+RESPONSE = {
+    "current": {
+        "values": [{"name": "PM25", "value": 12.5}, {"name": "TEMPERATURE", "value": 4.2}],
+        "standards": [{"pollutant": "PM25", "limit": 15}, {"pollutant": "PM10", "limit": 45}],
+    }
+}
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(wd.time, "monotonic", clock)
+    return clock
+
+def test_budget_checkpoints_are_cumulative(clock):
+    budget = wd.CycleBudget(10, (("fetch", 0.3), ("parse", 0.2), ("transfer", 0.5)))
+    assert budget.checkpoints == {"fetch": 1003.0, "parse": 1005.0, "transfer": 1010.0}
+    # Time a stage does not use carries forward to the next one
+    clock.now += 1
+    assert budget.finish("fetch")
+    assert budget.remaining("parse") == pytest.approx(4.0)
+    assert not budget.expired("parse")
+
+def test_budget_reports_overrun(clock, caplog):
+    budget = wd.CycleBudget(10, (("fetch", 0.3), ("transfer", 0.7)))
+    clock.now += 4
+    assert not budget.finish("fetch")
+    assert budget.expired("fetch")
+    assert budget.elapsed["fetch"] == pytest.approx(4.0)
+    assert "Stage fetch overran its budget by 1.00s" in caplog.text
+
+@pytest.fixture
+def cycle(tmp_path, monkeypatch):
+    """Runs one cycle with a stubbed fetch, recording what was drawn and displayed."""
+    calls = {"render": [], "display": 0}
+    render_weather = wd.render_weather
+
+    def render(weather, stale=False, *args, **kwargs):
+        calls["render"].append((weather, stale))
+        return render_weather(weather, stale, *args, **kwargs)
+
+    def display(epd, image, rotate):
+        calls["display"] += 1
+
+    monkeypatch.setattr(wd, "render_weather", render)
+    monkeypatch.setattr(wd, "display_image", display)
+    monkeypatch.setenv("AIRLY", "token")
+    args = argparse.Namespace(
+        source="airly", nearest=0, forecast_hours=0, rotate=False, seed_nearest=False,
+        cachefile=str(tmp_path / "weather_cache.json"),
+    )
+    config = {"url": "https://example.invalid/measurements", "latitude": 51.75,
+              "longitude": 19.45, "stations": {}}
+
+    def run(response, deadline=wd.CYCLE_DEADLINE):
+        monkeypatch.setattr(wd, "get_weather_conditions", lambda *a, **k: response)
+        wd.run_cycle(args, wd.CycleBudget(deadline), config)
+        return calls
+
+    run.cachefile = args.cachefile
+    return run
+
+def test_fresh_reading_is_cached_and_displayed(cycle):
+    calls = cycle(RESPONSE)
+    assert [stale for _, stale in calls["render"]] == [False]
+    assert calls["display"] == 1
+    with open(cycle.cachefile) as f:
+        assert json.load(f)["weather"]["pm25"] == 12.5
+
+def test_failed_fetch_shows_cache_with_marker(cycle):
+    cached = dict(wd.parse_airly_data(RESPONSE), pm25=30.0)
+    wd.save_cached_weather(cycle.cachefile, cached)
+    calls = cycle(None)
+    assert calls["render"] == [(cached, True)]
+    assert calls["display"] == 1
+
+def test_failed_fetch_with_old_cache_skips_refresh(cycle):
+    with open(cycle.cachefile, "w") as f:
+        json.dump({"timestamp": time.time() - wd.CACHE_MAX_AGE - 60, "weather": {"pm25": 30.0}}, f)
+    calls = cycle(None)
+    assert calls["render"] == []
+    assert calls["display"] == 0
+
+def test_failed_fetch_without_cache_skips_refresh(cycle):
+    calls = cycle(None)
+    assert calls["render"] == []
+    assert calls["display"] == 0
+
+def test_short_transfer_budget_skips_refresh(cycle):
+    # The whole deadline is below the time a refresh needs
+    calls = cycle(RESPONSE, deadline=wd.MIN_TRANSFER_TIME / 2)
+    assert len(calls["render"]) == 1
+    assert calls["display"] == 0
+
+def test_held_lock_skips_cycle(tmp_path, monkeypatch):
+    lockfile = str(tmp_path / "cycle.lock")
+    held = wd.acquire_cycle_lock(lockfile)
+    assert held is not None
+    args = argparse.Namespace(
+        config_cache=str(tmp_path / "snapshot.json"), datafile="data.json", source="airly",
+        city="lodz", location="lodz_bartoka", nearest=0, seed_nearest=False, daily_limit=0,
+        lockfile=lockfile, record=None, deadline=wd.CYCLE_DEADLINE,
+    )
+    ran = []
+    monkeypatch.setattr(wd, "input_arguments", lambda: args)
+    monkeypatch.setattr(wd, "load_config", lambda *a, **k: {})
+    monkeypatch.setattr(wd, "run_cycle", lambda *a: ran.append(a))
+    monkeypatch.setenv("AIRLY", "token")
+    try:
+        wd.main()
+        assert ran == []
+    finally:
+        held.close()
+    # Once released, the next cycle runs
+    wd.main()
+    assert len(ran) == 1
@@ -0,0 +1,85 @@
+import zlib
+import tracemalloc
+
+import pytest
+from PIL import Image, ImageDraw
+
+from tracefile import DriverTap
+from waveshare_epd import epd2in13_V4, epdconfig
+
+@pytest.fixture(autouse=True)
+def untapped(monkeypatch):
+    # DriverTap wraps these module functions, undo it after each test
+    for name in ("digital_write", "spi_writebyte", "spi_writebyte2"):
+        monkeypatch.setattr(epdconfig, name, getattr(epdconfig, name))
+
+def test_display_reproduces_image_and_command_sequence():
+    tap = DriverTap(epdconfig)
+    epd = epd2in13_V4.EPD()
+    epd.init()
+    tap.take()
+
+    image = Image.new("1", (epd.height, epd.width), 255)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([10, 10, 120, 60], fill=0)
+    draw.line([(0, 0), (epd.height - 1, epd.width - 1)], fill=0)
+    busy_before = epdconfig.statistics()["busy_ms"]
+    epd.display(epd.getbuffer(image))
+
+    commands = tap.take()
+    assert [c[0] for c in commands] == [0x24, 0x22, 0x20]
+    assert commands[0][1] == epd.buffer_size
+    assert commands[1][1] == 1
+    assert epdconfig.statistics()["busy_ms"] - busy_before == 2000
+
+    expected = image.rotate(90, expand=True)
+    assert epdconfig.image().tobytes() == expected.tobytes()
+
+def test_getbuffer_alternates_pooled_buffers():
+    epd = epd2in13_V4.EPD()
+    image = Image.new("1", (epd.height, epd.width), 255)
+    ImageDraw.Draw(image).rectangle([0, 0, 40, 40], fill=0)
+    views = [epd.getbuffer(image) for _ in range(3)]
+    assert all(isinstance(view, memoryview) and len(view) == epd.buffer_size for view in views)
+    assert views[0].obj is epd.frame_buffers[0]
+    assert views[1].obj is epd.frame_buffers[1]
+    assert views[2].obj is epd.frame_buffers[0]
+    assert bytes(views[2]) == image.rotate(90, expand=True).tobytes()
+
+def test_wrong_size_image_gives_blank_buffer():
+    epd = epd2in13_V4.EPD()
+    buf = epd.getbuffer(Image.new("1", (10, 10), 255))
+    assert len(buf) == epd.buffer_size
+    assert buf == bytes(epd.buffer_size)
+
+def test_clear_sends_cached_fill_buffer():
+    tap = DriverTap(epdconfig)
+    epd = epd2in13_V4.EPD()
+    epd.init()
+    tap.take()
+    epd.Clear(0xFF)
+    commands = tap.take()
+    assert commands[0] == [0x24, epd.buffer_size, zlib.crc32(b"\xff" * epd.buffer_size)]
+    assert epd.fill_buffer(0xFF) is epd.fill_buffer(0xFF)
+    blank = Image.new("1", epdconfig.image().size, 255)
+    assert epdconfig.image().tobytes() == blank.tobytes()
+
+def test_frames_and_clears_do_not_allocate_buffers():
+    epd = epd2in13_V4.EPD()
+    epd.init()
+    image = Image.new("1", (epd.height, epd.width), 255)
+    epd.Clear()
+    epd.getbuffer(image)
+    tracemalloc.start()
+    try:
+        for _ in range(20):
+            epd.Clear()
+        # A fresh list of ints per clear used to peak far above one frame
+        assert tracemalloc.get_traced_memory()[1] < epd.buffer_size // 4
+
+        before = tracemalloc.get_traced_memory()[0]
+        views = [epd.getbuffer(image) for _ in range(20)]
+        # Callers holding on to frames keep only views of the two pooled buffers
+        assert tracemalloc.get_traced_memory()[0] - before < len(views) * epd.buffer_size // 4
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,49 @@
+import datetime
+
+import weather_display as wd
+
+NOW = datetime.datetime(2026, 10, 19, 13, 30, tzinfo=datetime.timezone.utc)
+
+def entry(hour, pm25, pm10):
+    return {"fromDateTime": f"2026-10-19T{hour:02d}:00:00.000Z", "pm25": pm25, "pm10": pm10}
+
+def test_window_starts_at_the_current_hour():
+    forecast = [entry(h, 10, 20) for h in range(11, 20)]
+    levels = wd.forecast_levels(forecast, 15, 45, 3, now=NOW)
+    # 12:00 ended before 13:30, 13:00 is the hour in progress
+    assert len(levels) == 3
+    shifted = wd.forecast_levels(forecast, 15, 45, 3, now=NOW + datetime.timedelta(hours=2))
+    assert len(shifted) == 3
+    assert wd.forecast_levels(forecast, 15, 45, 24, now=NOW) == ((0.7, 0),) * 7
+
+def test_hour_exactly_one_hour_back_is_dropped():
+    forecast = [entry(12, 100, 100), entry(13, 1, 1)]
+    now = datetime.datetime(2026, 10, 19, 13, 0, tzinfo=datetime.timezone.utc)
+    assert wd.forecast_levels(forecast, 15, 45, 12, now=now) == ((0.1, 0),)
+
+def test_accepts_offsets_as_well_as_z():
+    forecast = [{"fromDateTime": "2026-10-19T15:00:00+02:00", "pm25": 30, "pm10": 30},
+                entry(14, 30, 30)]
+    # 15:00+02:00 is 13:00 UTC
+    assert len(wd.forecast_levels(forecast, 15, 45, 12, now=NOW)) == 2
+
+def test_missing_values_leave_gaps():
+    forecast = [entry(13, None, 20), entry(14, 10, None), entry(15, 10, 20)]
+    assert wd.forecast_levels(forecast, 15, 45, 12, now=NOW) == (None, None, (0.7, 0))
+
+def test_level_is_the_worse_of_pm25_and_pm10():
+    forecast = [
+        entry(13, 10, 100),  # PM10 over twice its norm
+        entry(14, 20, 10),   # PM2.5 between norm and twice the norm
+        entry(15, 5, 5),
+    ]
+    assert wd.forecast_levels(forecast, 15, 45, 12, now=NOW) == (
+        (2.2, 2), (1.3, 1), (0.3, 0)
+    )
+
+def test_strip_is_drawn_once_per_levels():
+    levels = ((0.5, 0), None, (1.5, 1), (2.5, 2))
+    strip = wd.render_forecast_strip(levels)
+    assert strip.size == wd.FORECAST_STRIP_SIZE
+    assert wd.render_forecast_strip(levels) is strip
+    assert wd.render_forecast_strip(levels[:2]) is not strip
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from json_stream import extract_json
+
+PAYLOAD = {
+    "history": [
+        {"note": "escaped \" quote, brackets ]}{[ and \\ backslash", "values": [[1, 2], {"a": "}"}]},
+        {"note": "zażółć \\\" ]", "values": []},
+    ],
+    "current": {
+        "fromDateTime": "2026-10-19T12:00:00.000Z",
+        "values": [{"name": "PM25", "value": 12345.678}, {"name": "PM10", "value": -0.5e-3}],
+        "indexes": [{"description": "Air is \"good\" {ok}"}],
+        "standards": [{"pollutant": "PM25", "limit": 15}],
+    },
+    "forecast": [
+        {"fromDateTime": "2026-10-19T13:00:00.000Z", "values": [{"name": "PM25", "value": 1.25}]},
+        {"fromDateTime": "2026-10-19T14:00:00.000Z", "values": [{"name": "PM25", "value": 22}]},
+    ],
+    "trailing": 1234567890,
+}
+
+def chunked(text, size):
+    raw = text.encode()
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+@pytest.mark.parametrize("size", range(1, 8))
+def test_selected_fields_across_small_chunks(size):
+    spec = {
+        "current": {"values": None, "standards": None},
+        "forecast": lambda item: item["values"][0]["value"],
+        "trailing": None,
+    }
+    result = extract_json(chunked(json.dumps(PAYLOAD, ensure_ascii=False), size), spec)
+    assert result == {
+        "current": {"values": PAYLOAD["current"]["values"], "standards": PAYLOAD["current"]["standards"]},
+        "forecast": [1.25, 22],
+        "trailing": 1234567890,
+    }
+
+@pytest.mark.parametrize("size", range(1, 8))
+def test_numbers_split_across_chunks(size):
+    text = '{"a": 1234567.875, "b": -98765e-2, "c": 7}'
+    assert extract_json(chunked(text, size), {"a": None, "b": None, "c": None}) == {
+        "a": 1234567.875, "b": -98765e-2, "c": 7
+    }
+
+def test_missing_selected_keys_are_left_out():
+    text = json.dumps({"current": {"values": [1]}, "history": []})
+    assert extract_json(chunked(text, 3), {"current": {"values": None, "standards": None},
+                                           "forecast": lambda item: item}) == {
+        "current": {"values": [1]}
+    }
+
+@pytest.mark.parametrize("size", range(1, 8))
+def test_null_in_place_of_nested_spec(size):
+    text = json.dumps({"current": None, "forecast": None})
+    assert extract_json(chunked(text, size), {"current": {"values": None},
+                                              "forecast": lambda item: item}) == {
+        "current": None, "forecast": None
+    }
+
+def test_stops_reading_once_selected_fields_are_found():
+    chunks = chunked(json.dumps(PAYLOAD), 4)
+    read = []
+
+    def source():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    text = json.dumps(PAYLOAD)
+    result = extract_json(source(), {"history": None})
+    assert result == {"history": PAYLOAD["history"]}
+    assert len(read) < len(chunks)
+    assert len(b"".join(read)) < len(text)
+
+def test_truncated_stream_raises():
+    with pytest.raises(ValueError):
+        extract_json(chunked('{"history": [1, 2', 3), {"current": None})
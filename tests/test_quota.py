@@ -0,0 +1,120 @@
+import os
+import time
+import multiprocessing
+
+import pytest
+
+from quota import QuotaManager, digest, lock_file
+
+class CountingLoad:
+    def __init__(self, data=None):
+        self.calls = 0
+        self.data = data
+
+    def __call__(self):
+        self.calls += 1
+        return self.data if self.data is not None else {"call": self.calls}
+
+def rewind(manager, key, seconds):
+    # Pretend the bucket was last updated this many seconds earlier
+    manager.update_bucket(key, lambda state, now: state.update(updated=now - seconds))
+
+def test_burst_then_refill_at_daily_rate(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=86400, burst=3)  # one token a second
+    assert [manager.acquire("key") for _ in range(4)] == [True, True, True, False]
+    rewind(manager, "key", 2.5)
+    assert [manager.acquire("key") for _ in range(3)] == [True, True, False]
+
+def test_refill_is_capped_at_burst(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=86400, burst=2)
+    assert manager.acquire("key") and manager.acquire("key")
+    rewind(manager, "key", 3600)
+    assert [manager.acquire("key") for _ in range(3)] == [True, True, False]
+
+def test_keys_have_separate_buckets(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=0, burst=1)
+    assert manager.acquire("one")
+    assert not manager.acquire("one")
+    assert manager.acquire("two")
+
+def test_block_after_rate_limit(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=86400, burst=5)
+    manager.block("key", 60)
+    rewind(manager, "key", 30)
+    assert not manager.acquire("key")
+    manager.update_bucket("key", lambda state, now: state.update(blocked_until=now - 1))
+    rewind(manager, "key", 1)
+    assert manager.acquire("key")
+
+def test_requests_within_ttl_share_one_call(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=100, ttl=60)
+    load = CountingLoad()
+    assert manager.fetch("key", "request", load) == {"call": 1}
+    assert manager.fetch("key", "request", load) == {"call": 1}
+    assert manager.fetch("key", "other", load) == {"call": 2}
+    assert load.calls == 2
+
+def test_requests_past_ttl_call_again(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=100, ttl=0)
+    load = CountingLoad()
+    manager.fetch("key", "request", load)
+    manager.fetch("key", "request", load)
+    assert load.calls == 2
+
+def test_lock_timeout_returns_none(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=100)
+    held = lock_file(os.path.join(str(tmp_path), f"response_{digest('request')}.json.lock"))
+    try:
+        load = CountingLoad()
+        start = time.monotonic()
+        assert manager.fetch("key", "request", load, timeout=0.2) is None
+        assert 0.2 <= time.monotonic() - start < 2
+        assert load.calls == 0
+    finally:
+        held.close()
+
+def test_out_of_quota_reuses_stored_response(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=0, burst=1, ttl=0, max_reuse_age=600)
+    load = CountingLoad()
+    assert manager.fetch("key", "request", load) == {"call": 1}
+    assert manager.fetch("key", "request", load) == {"call": 1}
+    assert load.calls == 1
+    assert len(manager.reused_ages) == 1 and not manager.refused
+
+    # Nothing stored for this one
+    assert manager.fetch("key", "other", load) is None
+    assert manager.refused
+
+def test_out_of_quota_does_not_reuse_old_response(tmp_path):
+    manager = QuotaManager(str(tmp_path), daily_limit=0, burst=1, ttl=0, max_reuse_age=600)
+    manager.fetch("key", "request", CountingLoad())
+    path = os.path.join(str(tmp_path), f"response_{digest('request')}.json")
+    old = time.time() - 3600
+    os.utime(path, (old, old))
+    assert manager.fetch("key", "request", CountingLoad()) is None
+    assert manager.refused and manager.reused_ages == []
+
+def fetch_in_process(state_dir, calls_path, results):
+    def load():
+        with open(calls_path, "a") as f:
+            f.write("call\n")
+        time.sleep(0.3)
+        return {"pm25": 12}
+    results.put(QuotaManager(state_dir, daily_limit=100).fetch("key", "request", load, timeout=10))
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_processes_share_one_upstream_call(tmp_path):
+    context = multiprocessing.get_context("fork")
+    calls_path = str(tmp_path / "calls")
+    results = context.Queue()
+    processes = [
+        context.Process(target=fetch_in_process, args=(str(tmp_path), calls_path, results))
+        for _ in range(8)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(20)
+    assert [results.get(timeout=5) for _ in processes] == [{"pm25": 12}] * 8
+    with open(calls_path) as f:
+        assert f.read().count("call") == 1
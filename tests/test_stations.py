@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from stations import StationIndex, aggregate_readings, chord_to_km, to_unit_vector
+
+@pytest.mark.parametrize("values", [[0, 0, 1], [3, 3, 5], [-0.5, -0.5, 0.8]])
+def test_small_differences_near_zero_are_kept(values):
+    readings = [(d, {"pm25": v, "temp": v}) for d, v in enumerate(values, 1)]
+    aggregated = aggregate_readings(readings)
+    # Every station contributes, so the mean lies strictly above the two agreeing ones
+    assert aggregated["pm25"] > min(values)
+    assert aggregated["temp"] > min(values)
+
+def brute_force(stations, lat, lon, k):
+    return sorted(
+        (chord_to_km(sum((a - b) ** 2 for a, b in zip(to_unit_vector(s_lat, s_lon),
+                                                        to_unit_vector(lat, lon)))), station_id)
+        for station_id, s_lat, s_lon in stations
+    )[:k]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_nearest_matches_brute_force(seed):
+    rng = random.Random(seed)
+    stations = [
+        (str(i), rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(300)
+    ]
+    # A dense cluster as well, like stations around one city
+    stations += [
+        (f"c{i}", 51.7 + rng.uniform(-0.2, 0.2), 19.4 + rng.uniform(-0.3, 0.3)) for i in range(100)
+    ]
+    index = StationIndex(stations)
+    assert index.size == len(stations)
+    for _ in range(20):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        for k in (1, 3, 10):
+            assert index.nearest(lat, lon, k) == pytest.approx(brute_force(stations, lat, lon, k))
+    assert index.nearest(51.75, 19.45, 5) == pytest.approx(brute_force(stations, 51.75, 19.45, 5))
+
+def test_empty_index():
+    index = StationIndex([])
+    assert index.size == 0
+    assert index.nearest(51.75, 19.45, 3) == []
+
+def test_k_larger_than_station_count():
+    stations = [("a", 51.75, 19.45), ("b", 52.23, 21.01)]
+    nearest = StationIndex(stations).nearest(51.75, 19.45, 10)
+    assert [station_id for _, station_id in nearest] == ["a", "b"]
+    assert nearest[0][0] == pytest.approx(0.0, abs=1e-6)
+    assert nearest[1][0] == pytest.approx(brute_force(stations, 51.75, 19.45, 2)[1][0])
+
+def test_outlier_is_rejected():
+    readings = [(1.0, {"pm25": 10.0}), (2.0, {"pm25": 11.0}), (3.0, {"pm25": 12.0}),
+                (0.5, {"pm25": 250.0})]
+    aggregated = aggregate_readings(readings)
+    assert 10.0 <= aggregated["pm25"] <= 12.0
+
+def test_weighted_towards_nearer_stations():
+    aggregated = aggregate_readings([(0.0, {"temp": 10.0}), (9.5, {"temp": 11.0})])
+    # Inverse square weights with the 0.5 km floor: 1/0.25 against 1/100
+    assert aggregated["temp"] == pytest.approx(round((10.0 * 4 + 11.0 * 0.01) / 4.01, 2))
+
+def test_norms_and_forecast_from_nearest_station():
+    forecast = [{"fromDateTime": "2026-10-19T13:00:00Z", "pm25": 5, "pm10": 8}]
+    readings = [
+        (4.0, {"pm25": 12.0, "pm25_norm": 25, "forecast": [], "pres": None}),
+        (1.0, {"pm25": 10.0, "pm25_norm": 15, "forecast": forecast, "pres": None}),
+    ]
+    aggregated = aggregate_readings(readings)
+    assert aggregated["pm25_norm"] == 15
+    assert aggregated["forecast"] == forecast
+    assert aggregated["pres"] is None
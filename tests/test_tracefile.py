@@ -0,0 +1,46 @@
+import threading
+
+from tracefile import TraceRecorder, read_trace, trace_cycles
+
+def response(pm25):
+    return {"current": {"values": [{"name": "PM25", "value": pm25}], "standards": []}}
+
+def test_station_responses_pair_with_their_own_distance(tmp_path):
+    path = str(tmp_path / "trace.gz")
+    recorder = TraceRecorder(path)
+    # Stations answer out of order, the fetch keeps nearest first
+    recorder.record("api", url="c", data=response(3), station="c", distance=3.0)
+    recorder.record("api", url="a", data=response(1), station="a", distance=1.0)
+    recorder.record("api", url="b", data=response(2), station="b", distance=2.0)
+    recorder.record("fetch", distances=[1.0, 2.0, 3.0])
+    recorder.end_cycle()
+    # Single location responses carry no distance
+    recorder.record("api", url="d", data=response(4))
+    recorder.record("fetch", distances=[0.0])
+    recorder.end_cycle()
+    recorder.close()
+
+    cycles = list(trace_cycles(read_trace(path)))
+    assert [responses for _, responses, _ in cycles] == [
+        [(1.0, response(1)), (2.0, response(2)), (3.0, response(3))],
+        [(0.0, response(4))],
+    ]
+
+def test_records_from_threads_stay_whole(tmp_path):
+    path = str(tmp_path / "trace.gz")
+    recorder = TraceRecorder(path)
+    payload = response(1.5) | {"padding": "x" * 5000}
+
+    def write():
+        for _ in range(50):
+            recorder.record("api", url="u", data=payload)
+
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.close()
+    records = list(read_trace(path))
+    assert len(records) == 400
+    assert all(record["data"] == payload for record in records)
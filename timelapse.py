@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import datetime
+import multiprocessing
+
+# Frames are only rendered, the panel is never touched
+os.environ["EPD_EMULATOR"] = "1"
+os.environ.pop("EPD_EMULATOR_OUTPUT", None)
+
+import weather_display as wd
+from PIL import Image
+from tracefile import read_trace, trace_cycles
+from waveshare_epd import epd2in13_V4
+
+FRAME_SIZE = (epd2in13_V4.EPD_HEIGHT, epd2in13_V4.EPD_WIDTH)
+
+def input_arguments():
+    parser = argparse.ArgumentParser(
+        description="Render what the display showed over stored measurements.",
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        "inputs", nargs="+", type=str,
+        help=("Saved Airly responses (JSON, frames from their history and current)\n"
+              "or trace files written by weather_display.py --record.")
+    )
+    parser.add_argument(
+        "--output", default="timelapse.gif", type=str,
+        help=("Animated GIF to write.")
+    )
+    parser.add_argument(
+        "--pbm-dir", default=None, type=str,
+        help=("Write one PBM file per frame to this directory instead of a GIF.")
+    )
+    parser.add_argument(
+        "--frame-ms", default=200, type=int,
+        help=("Duration of one GIF frame in milliseconds.")
+    )
+    parser.add_argument(
+        "--processes", default=os.cpu_count(), type=int,
+        help=("Number of rendering processes. Defaults to the number of cores.")
+    )
+    parser.add_argument(
+        "--forecast-hours", default=wd.FORECAST_HOURS, type=int,
+        help=("Hours of forecast drawn, as in weather_display.py.")
+    )
+    parser.add_argument(
+        "--rotate", action="store_true",
+        help=("Rotates frames by 180 degrees when provided.")
+    )
+    return parser.parse_args()
+
+def parse_time(text):
+    return datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+
+def load_samples(path):
+    """Return (time, weather, stale) samples, as the display would have drawn them."""
+    samples = []
+    if path.endswith(".gz"):
+        # One frame per recorded cycle, stations aggregated as in run_cycle()
+        weather = None
+        for when, responses, _ in trace_cycles(read_trace(path)):
+            fresh = wd.parse_readings("airly", responses)
+            stale = fresh is None
+            weather = weather if stale else fresh
+            if weather is not None:
+                samples.append((when, weather, stale))
+        return samples
+    with open(path) as f:
+        data = json.load(f)
+    items = data.get("history", []) + ([data["current"]] if "current" in data else [])
+    for item in items:
+        if not item.get("values"):
+            continue
+        try:
+            samples.append(
+                (parse_time(item["fromDateTime"]), wd.parse_airly_data({"current": item}), False)
+            )
+        except Exception as e:
+            logging.error("Skipping unreadable sample in %s: %s", path, e)
+    return samples
+
+def render_sample(task):
+    when, weather, stale, forecast_hours, rotate = task
+    try:
+        image = wd.render_weather(weather, stale, forecast_hours, now=when)
+    except Exception as e:
+        # One unreadable sample should not end the whole time-lapse
+        return None, f"{type(e).__name__}: {e}"
+    if rotate:
+        image = image.rotate(180)
+    return image.tobytes(), None
+
+def main():
+    args = input_arguments()
+    samples = []
+    for path in args.inputs:
+        try:
+            samples.extend(load_samples(path))
+        except Exception as e:
+            logging.error("Failed to load samples from %s: %s", path, e)
+    if not samples:
+        sys.exit("No samples to render")
+    samples.sort(key=lambda s: s[0])
+    logging.info("Rendering %d frames on %d processes", len(samples), args.processes)
+
+    # Drawing logs every missing value, keep workers quiet
+    logging.disable(logging.ERROR)
+    tasks = [
+        (when, weather, stale, args.forecast_hours, args.rotate) for when, weather, stale in samples
+    ]
+    chunksize = max(1, len(tasks) // (args.processes * 4))
+    rendered = []
+    failed = []
+    with multiprocessing.Pool(args.processes) as pool:
+        for (when, _, _), (data, error) in zip(samples, pool.imap(render_sample, tasks, chunksize)):
+            if data is None:
+                failed.append((when, error))
+            else:
+                rendered.append((when, Image.frombytes("1", FRAME_SIZE, data)))
+    logging.disable(logging.NOTSET)
+    for when, error in failed:
+        logging.warning("Skipped frame at %s: %s", when.isoformat(), error)
+    if not rendered:
+        sys.exit("No frames could be rendered")
+    frames = [frame for _, frame in rendered]
+
+    if args.pbm_dir:
+        os.makedirs(args.pbm_dir, exist_ok=True)
+        for i, (when, frame) in enumerate(rendered):
+            name = f"frame_{i:05d}_{when.strftime('%Y%m%dT%H%M')}.pbm"
+            frame.save(os.path.join(args.pbm_dir, name))
+        logging.info("Wrote %d frames to %s", len(frames), args.pbm_dir)
+    else:
+        frames[0].save(
+            args.output, save_all=True, append_images=frames[1:], duration=args.frame_ms, loop=0
+        )
+        logging.info("Wrote %d frames to %s", len(frames), args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import gzip
+import json
+import time
+import zlib
+import datetime
+import threading
+
+class DriverTap:
+    """Collects the command stream sent through epdconfig.
+
+    Each command is kept as [command, data_length, data_crc32], which is
+    enough to compare streams without storing whole frames.
+    """
+    def __init__(self, epdconfig):
+        self.commands = []
+        self.dc = 0
+        self.dc_pin = epdconfig.DC_PIN
+        digital_write = epdconfig.digital_write
+        spi_writebyte = epdconfig.spi_writebyte
+        spi_writebyte2 = epdconfig.spi_writebyte2
+
+        def tapped_digital_write(pin, value):
+            if pin == self.dc_pin:
+                self.dc = value
+            digital_write(pin, value)
+
+        def tapped_spi_writebyte(data):
+            self.tap(data)
+            spi_writebyte(data)
+
+        def tapped_spi_writebyte2(data):
+            self.tap(data)
+            spi_writebyte2(data)
+
+        epdconfig.digital_write = tapped_digital_write
+        epdconfig.spi_writebyte = tapped_spi_writebyte
+        epdconfig.spi_writebyte2 = tapped_spi_writebyte2
+
+    def tap(self, data):
+        if not self.dc:
+            self.commands.extend([command, 0, 0] for command in data)
+        elif self.commands:
+            entry = self.commands[-1]
+            entry[1] += len(data)
+            entry[2] = zlib.crc32(bytes(data), entry[2])
+
+    def take(self):
+        commands, self.commands = self.commands, []
+        return commands
+
+class TraceRecorder:
+    """Appends trace records as gzipped JSON lines, one gzip member per run."""
+    def __init__(self, path, epdconfig=None):
+        self.file = gzip.open(path, "at")
+        self.driver = DriverTap(epdconfig) if epdconfig is not None else None
+        # Stations are fetched from worker threads, each record must stay one whole line
+        self.lock = threading.Lock()
+
+    def record(self, kind, **fields):
+        line = json.dumps(dict(kind=kind, time=time.time(), **fields), separators=(",", ":"))
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def end_cycle(self):
+        self.record("cycle", driver=self.driver.take() if self.driver else [])
+
+    def close(self):
+        self.file.close()
+
+def read_trace(path):
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            yield json.loads(line)
+
+def trace_cycles(records):
+    """Group trace records into (time, responses, driver) per cycle.
+
+    responses pairs each Airly measurement response used by the cycle with
+    its station distance. Station responses carry their own distance, as
+    they are recorded in completion order; a response without one (single
+    location, or an older trace) takes the distance recorded after the fetch.
+    time is when the fetch finished, as a datetime in UTC.
+    """
+    by_distance = {}
+    unplaced = []
+    distances = []
+    fetched = None
+    for record in records:
+        if record["kind"] == "api":
+            if isinstance(record["data"], dict) and "current" in record["data"]:
+                if record.get("distance") is None:
+                    unplaced.append(record["data"])
+                else:
+                    by_distance.setdefault(record["distance"], []).append(record["data"])
+        elif record["kind"] == "fetch":
+            distances = record["distances"]
+            fetched = record["time"]
+        elif record["kind"] == "cycle":
+            responses = []
+            unplaced = unplaced[len(unplaced) - len(distances):]
+            for distance in distances:
+                # The latest response wins over a late one left from the previous cycle
+                if by_distance.get(distance):
+                    responses.append((distance, by_distance[distance].pop()))
+                elif unplaced:
+                    responses.append((distance, unplaced.pop(0)))
+            when = record["time"] if fetched is None else fetched
+            yield (datetime.datetime.fromtimestamp(when, datetime.timezone.utc),
+                   responses, record["driver"])
+            by_distance = {}
+            unplaced = []
+            distances = []
+            fetched = None
@@ -1,8 +1,15 @@
 import os
 import sys
 import json
+import time
+import fcntl
+import signal
 import logging
 import argparse
+import datetime
+import functools
+import tempfile
+import threading
 import requests
 from dotenv import load_dotenv
 from PIL import Image, ImageDraw, ImageFont
@@ -18,16 +25,99 @@ dotenvdir: str = os.path.join(BASE_DIR, ".env")
 if os.path.exists(libdir):
     sys.path.append(libdir)
 
-from waveshare_epd import epd2in13_V4
+from waveshare_epd import epd2in13_V4, epdconfig
+from json_stream import extract_json
+from stations import StationIndex, aggregate_readings
+from quota import QuotaManager, DEFAULT_BACKOFF
+from tracefile import TraceRecorder
+from config import ConfigError, load_config
 
 # Load .env variables
 try:
     load_dotenv(dotenvdir)
 except Exception as exception:
-    logging.error("Failed to load: %e", exception)
+    logging.error("Failed to load: %s", exception)
 
 # Constants
 FONT_SIZE = 24
+# Hours of PM forecast shown in the upper right strip, 0 shows clip-art instead
+FORECAST_HOURS = 12
+FORECAST_STRIP_SIZE = (110, 18)
+
+# Cycle deadline, split into consecutive stage budgets (fractions of the deadline).
+# Time left over by a stage carries forward to the next one.
+CYCLE_DEADLINE = 55
+STAGE_SHARES = (
+    ("fetch", 0.35),
+    ("parse", 0.05),
+    ("render", 0.15),
+    ("transfer", 0.45),
+)
+# Size of response chunks fed to the streaming JSON extraction
+STREAM_CHUNK_SIZE = 4096
+# Parts of the Airly response needed by parse_airly_data(), everything else is skipped
+AIRLY_FIELDS = {"current": {"values": None, "standards": None}}
+
+# Upper bound of concurrent requests when reading several stations
+MAX_PARALLEL_FETCHES = 4
+# Search radius for seeding stations from Airly nearest installations
+NEAREST_MAX_DISTANCE = 25
+# Seeded stations are fetched again after this many seconds
+SEED_MAX_AGE = 24 * 3600
+
+# Airly free tier daily request limit per API key
+DAILY_LIMIT = 100
+
+# Minimum time needed to init, clear, refresh and power off the panel
+MIN_TRANSFER_TIME = 15
+# Time kept after the busy deadline to put the panel to sleep and release
+# GPIO/SPI before the hard stop
+POWER_OFF_TIME = 3
+# Cached readings older than this are not shown at all
+CACHE_MAX_AGE = 6 * 3600
+
+# Shared request quota and trace recorder, set up in main()
+quota_manager = None
+trace_recorder = None
+
+class CycleTimeout(Exception):
+    pass
+
+class CycleBudget:
+    def __init__(self, deadline=CYCLE_DEADLINE, shares=STAGE_SHARES):
+        self.start = time.monotonic()
+        self.deadline = deadline
+        self.checkpoints = {}
+        self.elapsed = {}
+        self.last = self.start
+        total = 0
+        for stage, share in shares:
+            total += share
+            self.checkpoints[stage] = self.start + deadline * total
+
+    def remaining(self, stage):
+        return max(0.0, self.checkpoints[stage] - time.monotonic())
+
+    def expired(self, stage):
+        return self.remaining(stage) <= 0
+
+    def finish(self, stage):
+        now = time.monotonic()
+        self.elapsed[stage] = now - self.last
+        self.last = now
+        if now > self.checkpoints[stage]:
+            logging.warning(
+                "Stage %s overran its budget by %.2fs", stage, now - self.checkpoints[stage]
+            )
+            return False
+        return True
+
+    def report(self):
+        for stage, elapsed in self.elapsed.items():
+            logging.info("Stage %s took %.2fs", stage, elapsed)
+        logging.info(
+            "Cycle took %.2fs of %.2fs deadline", time.monotonic() - self.start, self.deadline
+        )
 
 def input_arguments():
     parser = argparse.ArgumentParser(
@@ -54,70 +144,282 @@ def input_arguments():
         "--source", default="airly", type=str, choices=["airly"],
         help=("Choose source for weather data. Available choices are: airly.")
     )
+    parser.add_argument(
+        "--forecast-hours", default=FORECAST_HOURS, type=int,
+        help=("Hours of PM2.5/PM10 forecast drawn in the upper right corner.\n"
+              "0 disables the forecast.")
+    )
+    parser.add_argument(
+        "--nearest", default=0, type=int,
+        help=("Aggregate readings of this many stations nearest to the city instead of\n"
+              "reading --location only. Stations need latitude and longitude in datafile.")
+    )
+    parser.add_argument(
+        "--seed-nearest", action="store_true",
+        help=("Add stations from Airly nearest installations to the ones in datafile.\n"
+              "Costs one more API request a day, seeded stations are kept in --seed-cache.")
+    )
+    parser.add_argument(
+        "--seed-cache", default=os.path.join(BASE_DIR, ".seeded_stations.json"), type=str,
+        help=("Path to file with stations seeded by --seed-nearest.")
+    )
+    parser.add_argument(
+        "--daily-limit", default=DAILY_LIMIT, type=int,
+        help=("Daily request limit of the API key, spread evenly over the day and shared\n"
+              "by all processes using the same --quota-dir. 0 disables the limit.")
+    )
+    parser.add_argument(
+        "--quota-dir", default=os.path.join(tempfile.gettempdir(), "weather_display"), type=str,
+        help=("Directory with request quota state and responses shared between processes.")
+    )
+    parser.add_argument(
+        "--config-cache", default=os.path.join(BASE_DIR, ".config_snapshot.json"), type=str,
+        help=("Path to compiled snapshot of datafile, rebuilt when datafile or .env change.")
+    )
+    parser.add_argument(
+        "--record", default=None, type=str,
+        help=("Append provider responses and driver command stream to this trace file,\n"
+              "for replay with soak.py.")
+    )
+    parser.add_argument(
+        "--deadline", default=CYCLE_DEADLINE, type=float,
+        help=("Time limit in seconds for a whole refresh cycle.\n"
+              "Should be shorter than the cron interval.")
+    )
+    parser.add_argument(
+        "--cachefile", default=os.path.join(BASE_DIR, "weather_cache.json"), type=str,
+        help=("Path to file with last successfully fetched weather conditions.")
+    )
+    parser.add_argument(
+        "--lockfile", default=os.path.join(BASE_DIR, ".weather_display.lock"), type=str,
+        help=("Path to lock file preventing overlapping refresh cycles.")
+    )
     return parser.parse_args()
 
-def load_api_data(url, headers=None):
+def load_api_data(url, headers=None, timeout=None, fields=None, trace=None):
+    if quota_manager is None:
+        data = request_api_data(url, headers, timeout, fields)
+    else:
+        key = headers.get("apikey") if headers else None
+        request = url + json.dumps(fields, default=lambda f: f.__name__, sort_keys=True)
+        data = quota_manager.fetch(
+            key, request, lambda: request_api_data(url, headers, timeout, fields), timeout
+        )
+    if trace_recorder is not None:
+        trace_recorder.record("api", url=url, data=data, **(trace or {}))
+    return data
+
+def request_api_data(url, headers=None, timeout=None, fields=None):
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        if fields is None:
+            response = requests.get(url, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+        # Decode only the selected fields while the body arrives,
+        # and stop reading once all of them have been found
+        with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            return extract_json(response.iter_content(STREAM_CHUNK_SIZE), fields)
     except requests.exceptions.RequestException as e:
-        logging.error("Failed to fetch data from %u: %e", url, e)
+        logging.error("Failed to fetch data from %s: %s", url, e)
+        response = getattr(e, "response", None)
+        key = headers.get("apikey") if headers else None
+        if response is not None and response.status_code == 429 and key and quota_manager:
+            try:
+                backoff = int(response.headers.get("Retry-After", DEFAULT_BACKOFF))
+            except ValueError:
+                backoff = DEFAULT_BACKOFF
+            quota_manager.block(key, backoff)
         return None
-    except json.JSONDecodeError as e:
-        logging.error("Failed to decode JSON response from %u: %e", url, e)
+    except ValueError as e:
+        logging.error("Failed to decode JSON response from %s: %s", url, e)
         return None
 
-def get_weather_conditions(provider, city, geo_location, location_id, token):
+def reduce_airly_forecast(item):
+    values = item["values"]
+    return {
+        "fromDateTime": item["fromDateTime"],
+        "pm25": next((v["value"] for v in values if v["name"] == "PM25"), None),
+        "pm10": next((v["value"] for v in values if v["name"] == "PM10"), None),
+    }
+
+def weather_conditions_url(provider, lat, lon, location_id):
     base_urls = {
         "airly": "https://airapi.airly.eu/v2/measurements/"
     }
-    lat = geo_location[city]['latitude']
-    lon = geo_location[city]['longitude']
     urls = {
         "airly": f"point?lat={lat}&lng={lon}&locationId={location_id}"
     }
+    return base_urls[provider] + urls[provider]
+
+def station_conditions_url(provider, location_id):
+    base_urls = {
+        "airly": "https://airapi.airly.eu/v2/measurements/"
+    }
+    urls = {
+        "airly": f"location?locationId={location_id}"
+    }
+    return base_urls[provider] + urls[provider]
+
+def conditions_fields(provider, forecast=False):
+    # Parts of the response read by the parser of each provider, None reads all of it
+    fields = {
+        "airly": dict(AIRLY_FIELDS, forecast=reduce_airly_forecast) if forecast else AIRLY_FIELDS
+    }
+    return fields.get(provider)
+
+def get_weather_conditions(provider, url, token, timeout=None, forecast=False, trace=None):
     use_headers = {
         "airly": True
     }
     try:
-        base_url = base_urls.get(provider)
-        url = base_url + urls.get(provider)
         headers = {"Accept": "application/json", "apikey": token} if use_headers[provider] else None
-        data = load_api_data(url, headers)
+        data = load_api_data(url, headers, timeout, conditions_fields(provider, forecast), trace)
         return data
+    except CycleTimeout:
+        raise
     except Exception as e:
-        logging.error("Failed to load %s weather conditions: %e", provider, e)
+        logging.error("Failed to load %s weather conditions: %s", provider, e)
         return None
 
-def init_display():
+def get_station_conditions(provider, location_id, token, timeout=None, forecast=False,
+                           distance=None):
+    # Responses arrive in completion order, the trace keeps which station each is from
+    trace = {"station": str(location_id), "distance": distance} if distance is not None else None
+    return get_weather_conditions(
+        provider, station_conditions_url(provider, location_id), token, timeout, forecast, trace
+    )
+
+def load_airly_installations(lat, lon, token, max_results, timeout=None):
+    url = (
+        "https://airapi.airly.eu/v2/installations/nearest"
+        f"?lat={lat}&lng={lon}&maxDistanceKM={NEAREST_MAX_DISTANCE}&maxResults={max_results}"
+    )
+    headers = {"Accept": "application/json", "apikey": token}
+    installations = load_api_data(url, headers, timeout)
+    if not isinstance(installations, list):
+        return {}
+    stations = {}
+    for i in installations:
+        try:
+            location_id = str(i.get("locationId", i["id"]))
+            stations[location_id] = {
+                "id": location_id,
+                "latitude": float(i["location"]["latitude"]),
+                "longitude": float(i["location"]["longitude"]),
+            }
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logging.warning("Skipping installation without a usable location: %s", e)
+    return stations
+
+def load_seeded_stations(path, lat, lon, k, token, timeout=None, max_age=SEED_MAX_AGE):
+    # Installations rarely move, so seeded stations are reused for max_age
+    # instead of costing a request every run
+    query = [lat, lon, k]
+    cached = None
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached["query"] == query and time.time() - cached["timestamp"] < max_age:
+            return cached["stations"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    stations = load_airly_installations(lat, lon, token, k, timeout)
+    if not stations:
+        if cached and cached.get("query") == query:
+            logging.warning("Seeding stations failed, using previously seeded ones")
+            return cached.get("stations") or {}
+        return {}
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump({"timestamp": time.time(), "query": query, "stations": stations}, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.error("Failed to save seeded stations: %s", e)
+    return stations
+
+def station_id(station):
+    # Stations are either a bare ID or an object with ID and coordinates
+    return station["id"] if isinstance(station, dict) else station
+
+def get_nearest_conditions(provider, lat, lon, stations, k, token, timeout, seed_cache=None,
+                           forecast=False):
+    deadline = time.monotonic() + timeout
+    if seed_cache:
+        # Stations in datafile take precedence over seeded ones with the same ID
+        known = {station_id(s) for s in stations.values()}
+        seeded = load_seeded_stations(seed_cache, lat, lon, k, token, timeout)
+        stations = dict(stations, **{
+            key: s for key, s in seeded.items() if s["id"] not in known and key not in stations
+        })
+    index = StationIndex(
+        (station_id(s), s["latitude"], s["longitude"])
+        for s in stations.values() if isinstance(s, dict) and "latitude" in s
+    )
+    nearest = index.nearest(lat, lon, k)
+    logging.info("Nearest of %d stations: %s", index.size, nearest)
+    # Daemon threads, so a station still answering past the deadline cannot keep
+    # the process alive after main() has released the cycle lock
+    responses = [None] * len(nearest)
+    slots = threading.BoundedSemaphore(MAX_PARALLEL_FETCHES)
+
+    def fetch(i, distance, location_id):
+        with slots:
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                # Forecast is taken from the nearest station only
+                responses[i] = get_station_conditions(
+                    provider, location_id, token, remaining, forecast and i == 0, distance
+                )
+
+    threads = [
+        threading.Thread(target=fetch, args=(i, distance, location_id), daemon=True)
+        for i, (distance, location_id) in enumerate(nearest)
+    ]
+    for thread in threads:
+        thread.start()
+    results = []
+    for i, ((distance, _), thread) in enumerate(zip(nearest, threads)):
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            logging.warning("Station %.1fkm away did not answer in time", distance)
+        elif responses[i] is not None:
+            results.append((distance, responses[i]))
+    return results
+
+def init_display(epd):
     logging.info("Initializing")
-    epd = epd2in13_V4.EPD()
     epd.init()
     epd.Clear(0xFF)
+    return epd
 
+def new_canvas():
     logging.info("Drawing on the image")
-    image = Image.new("1", (epd.height, epd.width), 255)
+    image = Image.new("1", (epd2in13_V4.EPD_HEIGHT, epd2in13_V4.EPD_WIDTH), 255)
     draw = ImageDraw.Draw(image)
-    return epd, image, draw
+    return image, draw
+
+@functools.lru_cache(maxsize=None)
+def load_font(size):
+    return ImageFont.truetype(os.path.join(picdir, "Font.ttc"), size)
+
+@functools.lru_cache(maxsize=None)
+def load_picture(filename, rotation=None):
+    # Decoded once per process, every frame pastes the same few icons
+    with Image.open(os.path.join(picdir, filename)) as picture:
+        return picture.rotate(rotation) if rotation else picture.copy()
 
 def draw_text(image_draw, res_h, res_w, text, size=FONT_SIZE):
     try:
-        image_draw.text(
-            (res_h, res_w), text, fill=0,
-            font=ImageFont.truetype(os.path.join(picdir, "Font.ttc"), size)
-        )
+        image_draw.text((res_h, res_w), text, fill=0, font=load_font(size))
     except Exception as e:
-        logging.error("Failed to draw text: %e", e)
+        logging.error("Failed to draw text: %s", e)
 
 def draw_image(image_canvas, res_h, res_w, filename, rotation=None):
     try:
-        this_image = Image.open(os.path.join(picdir, filename))
-        if rotation:
-            this_image = this_image.rotate(rotation)
-        image_canvas.paste(this_image, (res_h, res_w))
+        image_canvas.paste(load_picture(filename, rotation), (res_h, res_w))
     except Exception as e:
-        logging.error("Failed to draw image: %e", e)
+        logging.error("Failed to draw image: %s", e)
 
 def fill_empty_space(canvas, res_h, res_w):
     draw_image(canvas, res_h, res_w, "sun.bmp")
@@ -132,7 +434,7 @@ def air_quality_emote(quality_level, norm_good, norm_medium):
             return "emote_meh.bmp"
         return "emote_bad_air.bmp"
     except Exception as e:
-        logging.error("Failed to determine air quality emote: %e", e)
+        logging.error("Failed to determine air quality emote: %s", e)
         return None
 
 def draw_intersecting_lines(image_canvas, res_h, res_w, width = 4):
@@ -159,7 +461,7 @@ def draw_norms(text_canvas, res_h, res_w, image_canvas, data):
         pm25_norm = data["pm25_norm"]
         pm10_norm = data["pm10_norm"]
     except Exception as e:
-        logging.error("Failed to determine weather norms: %e", e)
+        logging.error("Failed to determine weather norms: %s", e)
     # Draw PM2.5 norm, upper left
     draw_image(image_canvas, res_h + 22, res_w, "pm25_icon.bmp")
     draw_image(image_canvas, res_h + 62, res_w, air_quality_emote(pm25, pm25_norm, 2 * pm25_norm))
@@ -178,16 +480,78 @@ def draw_single_condition(param, unit, image_canvas, text_canvas, res_h, res_w,
     else:
         fill_empty_space(image_canvas, res_h, res_w)
 
-def draw_conditions(text_canvas, image_canvas, data):
+def forecast_levels(forecast, pm25_norm, pm10_norm, hours, now=None):
+    # One pass over the upcoming hours, giving (bar height ratio, air quality level) per hour
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    hour_start = now - datetime.timedelta(hours=1)
+    emote_levels = {"emote_smile.bmp": 0, "emote_meh.bmp": 1, "emote_bad_air.bmp": 2}
+    upcoming = [
+        (f["pm25"], f["pm10"]) for f in forecast
+        if datetime.datetime.fromisoformat(f["fromDateTime"].replace("Z", "+00:00")) > hour_start
+    ][:hours]
+    return tuple(
+        (
+            round(max(pm25 / pm25_norm, pm10 / pm10_norm), 1),
+            max(emote_levels[air_quality_emote(pm25, pm25_norm, 2 * pm25_norm)],
+                emote_levels[air_quality_emote(pm10, pm10_norm, 2 * pm10_norm)]),
+        ) if pm25 is not None and pm10 is not None else None
+        for pm25, pm10 in upcoming
+    )
+
+@functools.lru_cache(maxsize=4)
+def render_forecast_strip(levels, size=FORECAST_STRIP_SIZE):
+    # Cached on the levels, so unchanged forecasts are not drawn again. The cache
+    # lives as long as the process, which pays off in soak.py and timelapse.py;
+    # a cron run draws the strip once either way
+    width, height = size
+    strip = Image.new("1", size, 255)
+    draw = ImageDraw.Draw(strip)
+    draw.line([(0, height - 1), (width - 1, height - 1)], fill=0)
+    slot = width // max(len(levels), 1)
+    for i, level in enumerate(levels):
+        if level is None:
+            continue
+        ratio, quality = level
+        # Bars reach full height at twice the norm
+        top = height - 1 - max(1, int(min(ratio / 2, 1) * (height - 2)))
+        box = [i * slot, top, i * slot + slot - 2, height - 1]
+        if quality == 2:
+            draw.rectangle(box, fill=0)
+        elif quality == 1:
+            mid = (box[0] + box[2]) // 2
+            draw.rectangle(box, outline=0)
+            draw.line([(mid, top), (mid, height - 1)], fill=0)
+        else:
+            draw.rectangle(box, outline=0)
+    return strip
+
+def draw_forecast(image_canvas, res_h, res_w, data, hours, now=None):
+    try:
+        levels = forecast_levels(
+            data["forecast"], data["pm25_norm"], data["pm10_norm"], hours, now
+        )
+    except Exception as e:
+        logging.error("Failed to determine forecast: %s", e)
+        return False
+    if not levels:
+        return False
+    image_canvas.paste(render_forecast_strip(levels), (res_h, res_w))
+    return True
+
+def draw_conditions(text_canvas, image_canvas, data, forecast_hours=FORECAST_HOURS, now=None):
     try:
         temperature = data["temp"]
         humidity = data["humi"]
         pressure = data["pres"]
     except Exception as e:
-        logging.error("Failed to determine weather conditions: %e", e)
+        logging.error("Failed to determine weather conditions: %s", e)
 
-    # Draw Weather icons, upper right
-    fill_empty_space(image_canvas, 134, 6)
+    # Draw forecast strip or Weather icons, upper right
+    drawn = forecast_hours and data.get("forecast") and draw_forecast(
+        image_canvas, 134, 4, data, forecast_hours, now
+    )
+    if not drawn:
+        fill_empty_space(image_canvas, 134, 6)
 
     draw_single_condition(temperature, "°C", image_canvas, text_canvas, 132, 24, "termometer.bmp")
     draw_single_condition(humidity, "%", image_canvas, text_canvas, 130, 64, "water_droplet.bmp")
@@ -195,13 +559,20 @@ def draw_conditions(text_canvas, image_canvas, data):
 
     return text_canvas, image_canvas
 
+def draw_stale_marker(text_canvas, res_h, res_w):
+    draw_text(text_canvas, res_h, res_w, "!", 16)
+    return text_canvas
+
 def display_image(epd, image_canvas, rotate):
     try:
+        init_display(epd)
         if rotate:
             image_canvas = image_canvas.rotate(180)
-        epd.displayPartBaseImage(epd.getbuffer(image_canvas))
+        epd.display(epd.getbuffer(image_canvas))
+    except CycleTimeout:
+        raise
     except Exception as e:
-        logging.error("Failed to draw: %e", e)
+        logging.error("Failed to draw: %s", e)
     finally:
         logging.info("Powering off the screen")
         epd.sleep()
@@ -210,7 +581,7 @@ def get_token(source):
     try:
         return os.environ.get(source.upper())
     except Exception as e:
-        logging.error("Failed to set constants: %e", e)
+        logging.error("Failed to set constants: %s", e)
         return None
 
 def parse_airly_data(data):
@@ -224,30 +595,179 @@ def parse_airly_data(data):
     values["temp"] = next((v["value"] for v in data_values if v["name"] == "TEMPERATURE"), None)
     values["pm25_norm"] = next((n["limit"] for n in data_norms if n["pollutant"] == "PM25"), None)
     values["pm10_norm"] = next((n["limit"] for n in data_norms if n["pollutant"] == "PM10"), None)
+    values["forecast"] = data.get("forecast")
     return values
 
+def parse_readings(source, responses):
+    """Parse (distance_km, response) pairs and combine them into one weather dict.
+
+    Returns None when no response could be parsed.
+    """
+    readings = []
+    for distance, response in responses:
+        try:
+            if source == "airly":
+                readings.append((distance, parse_airly_data(response)))
+        except Exception as e:
+            logging.error("Failed to parse weather conditions: %s", e)
+    return aggregate_readings(readings) if readings else None
+
+def save_cached_weather(path, weather):
+    try:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"timestamp": time.time(), "weather": weather}, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error("Failed to save cached weather conditions: %s", e)
+
+def load_cached_weather(path, max_age=CACHE_MAX_AGE):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except Exception as e:
+        logging.error("Failed to load cached weather conditions: %s", e)
+        return None
+    age = time.time() - cached["timestamp"]
+    if age > max_age:
+        logging.warning("Cached weather conditions are too old (%ds)", age)
+        return None
+    logging.warning("Using cached weather conditions from %ds ago", age)
+    return cached["weather"]
+
+def acquire_cycle_lock(path):
+    lock = open(path, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+def raise_cycle_timeout(signum, frame):
+    raise CycleTimeout("Cycle deadline exceeded")
+
+def render_weather(weather, stale=False, forecast_hours=FORECAST_HOURS, now=None):
+    image, draw = new_canvas()
+    draw = draw_intersecting_lines(draw, epd2in13_V4.EPD_HEIGHT, epd2in13_V4.EPD_WIDTH, 4)
+    image = draw_corners(image, epd2in13_V4.EPD_HEIGHT, epd2in13_V4.EPD_WIDTH, 3)
+    draw, image = draw_norms(draw, 6, 4, image, weather)
+    draw, image = draw_conditions(draw, image, weather, forecast_hours, now)
+    if stale:
+        draw = draw_stale_marker(draw, 238, 2)
+    return image
+
+def run_cycle(args, budget, config):
+    # Fetch, as (distance_km, response) pairs
+    weather_data = []
+    if quota_manager is not None:
+        quota_manager.refused = False
+        quota_manager.reused_ages = []
+    try:
+        token = get_token(args.source)
+        if args.source == "airly" and not budget.expired("fetch") and args.nearest:
+            weather_data = get_nearest_conditions(
+                args.source, config["latitude"], config["longitude"],
+                config["stations"], args.nearest, token,
+                timeout=budget.remaining("fetch"),
+                seed_cache=args.seed_cache if args.seed_nearest else None,
+                forecast=args.forecast_hours > 0
+            )
+        elif args.source == "airly" and not budget.expired("fetch"):
+            response = get_weather_conditions(
+                args.source, config["url"], token,
+                timeout=budget.remaining("fetch"), forecast=args.forecast_hours > 0
+            )
+            if response is not None:
+                weather_data = [(0.0, response)]
+    except CycleTimeout:
+        raise
+    except Exception as e:
+        logging.error("Failed to fetch weather conditions: %s", e)
+    budget.finish("fetch")
+    if trace_recorder is not None:
+        trace_recorder.record("fetch", distances=[distance for distance, _ in weather_data])
+
+    # Parse, falling back to cached values marked as stale
+    weather = parse_readings(args.source, weather_data)
+    budget.finish("parse")
+    # Responses stored before the quota ran out are shown as stale, like the cache
+    reused = quota_manager is not None and bool(quota_manager.reused_ages)
+    if weather is not None and reused:
+        logging.warning(
+            "Showing responses reused from up to %ds ago", max(quota_manager.reused_ages)
+        )
+    stale = weather is None or reused
+    if weather is None and quota_manager is not None and quota_manager.refused:
+        # Redrawing the same cached values with the marker would only cost a refresh
+        logging.warning("Out of API quota with nothing stored, keeping the current image")
+        return
+    if weather is None:
+        weather = load_cached_weather(args.cachefile)
+        if weather is None:
+            logging.error("No fresh or cached weather conditions, skipping refresh")
+            return
+    elif not stale:
+        save_cached_weather(args.cachefile, weather)
+
+    # Render
+    image = render_weather(weather, stale, args.forecast_hours)
+    budget.finish("render")
+
+    # Transfer, only when there is enough time left to finish it
+    if budget.remaining("transfer") < MIN_TRANSFER_TIME:
+        logging.warning(
+            "Only %.2fs left for transfer, skipping refresh", budget.remaining("transfer")
+        )
+        return
+    epd = epd2in13_V4.EPD()
+    epd.busy_deadline = budget.checkpoints["transfer"] - POWER_OFF_TIME
+    display_image(epd, image, args.rotate)
+    budget.finish("transfer")
+
 def main():
+    global quota_manager, trace_recorder
     try:
         args = input_arguments()
-        token = get_token(args.source)
-        with open(args.datafile) as f:
-            data = json.load(f)
-        geo_locs = data["geographic_locations"]
-        stations = data["stations"]
-        station = stations[args.source][args.location]
-        if args.source == "airly":
-            weather_data = get_weather_conditions(
-                args.source, args.city, geo_locs, station, token
+        # Validate configuration before any hardware or network work
+        config = load_config(
+            args.config_cache, args.datafile, args.source, args.city, args.location,
+            weather_conditions_url, dotenvdir, need_location=not args.nearest,
+            # Seeded stations bring their own coordinates
+            need_coordinates=bool(args.nearest) and not args.seed_nearest
+        )
+        if not get_token(args.source):
+            raise ConfigError(f"API token {args.source.upper()} is not set")
+        if args.daily_limit > 0:
+            quota_manager = QuotaManager(
+                args.quota_dir, args.daily_limit, max_reuse_age=CACHE_MAX_AGE
             )
-            weather = parse_airly_data(weather_data)
-        epd, image, draw = init_display()
-        draw = draw_intersecting_lines(draw, epd.height, epd.width, 4)
-        image = draw_corners(image, epd.height, epd.width, 3)
-        draw, image = draw_norms(draw, 6, 4, image, weather)
-        draw, image = draw_conditions(draw, image, weather)
-        display_image(epd, image, args.rotate)
+        lock = acquire_cycle_lock(args.lockfile)
+        if lock is None:
+            logging.warning("Previous cycle is still running, skipping this one")
+            return
+        if args.record:
+            trace_recorder = TraceRecorder(args.record, epdconfig)
+        budget = CycleBudget(args.deadline)
+        # Hard stop, so a hung cycle can never hold the lock past its deadline
+        signal.signal(signal.SIGALRM, raise_cycle_timeout)
+        signal.setitimer(signal.ITIMER_REAL, args.deadline)
+        try:
+            run_cycle(args, budget, config)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            budget.report()
+            if trace_recorder is not None:
+                trace_recorder.end_cycle()
+                trace_recorder.close()
+            lock.close()
+    except ConfigError as e:
+        logging.error("Invalid configuration: %s", e)
+        sys.exit(2)
+    except CycleTimeout as e:
+        logging.error("%s, cycle abandoned", e)
     except Exception as e:
-        logging.error("Failed to execute main function: %e", e)
+        logging.error("Failed to execute main function: %s", e)
 
 if __name__ == "__main__":
     main()